@@ -0,0 +1,63 @@
+
+# -*- coding: utf-8 -*-
+"""SQLite storage for subscriber data.
+
+KOOLEXIL.xlsx is kept only as the import/export format; the working copy
+lives in subscribers.db so reads are indexed B-tree lookups instead of
+re-parsing zipped XML on every update.
+"""
+import os, sqlite3, threading
+
+BASE_DIR = os.path.dirname(__file__)
+DB_FILE = os.path.join(BASE_DIR, "subscribers.db")
+TABLE = "subscribers"
+INDEXED_COLS = ("رقم العداد","رقم الهاتف","اسم المشترك")
+
+LOGS_DB_FILE = os.path.join(BASE_DIR, "logs.db")
+EVENTS_TABLE = "events"
+
+_conn = None
+_log_conn = None
+_conn_lock = threading.Lock()
+
+def get_conn():
+    global _conn
+    with _conn_lock:
+        if _conn is None:
+            _conn = sqlite3.connect(DB_FILE, check_same_thread=False)
+            _conn.execute("PRAGMA journal_mode=WAL")
+            _conn.execute("PRAGMA synchronous=NORMAL")
+        return _conn
+
+def get_log_conn():
+    global _log_conn
+    with _conn_lock:
+        if _log_conn is None:
+            _log_conn = sqlite3.connect(LOGS_DB_FILE, check_same_thread=False, isolation_level=None)
+            _log_conn.execute("PRAGMA journal_mode=WAL")
+            _log_conn.execute(f"CREATE TABLE IF NOT EXISTS {EVENTS_TABLE} "
+                              "(timestamp TEXT, user TEXT, action TEXT, amount REAL, meter TEXT, subscriber TEXT)")
+        return _log_conn
+
+def log_insert(ts, user, action, amount, meter, subscriber):
+    get_log_conn().execute(f"INSERT INTO {EVENTS_TABLE} VALUES (?,?,?,?,?,?)",
+                           (ts, user, action, amount, meter, subscriber))
+
+def log_insert_many(rows):
+    get_log_conn().executemany(f"INSERT INTO {EVENTS_TABLE} VALUES (?,?,?,?,?,?)", rows)
+
+def table_exists():
+    cur = get_conn().execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (TABLE,))
+    return cur.fetchone() is not None
+
+def read_df():
+    import pandas as pd
+    return pd.read_sql_query(f'SELECT * FROM "{TABLE}"', get_conn())
+
+def write_df(df):
+    conn = get_conn()
+    df.to_sql(TABLE, conn, if_exists="replace", index=False)
+    for col in INDEXED_COLS:
+        if col in df.columns:
+            conn.execute(f'CREATE INDEX IF NOT EXISTS "idx_{col}" ON "{TABLE}" ("{col}")')
+    conn.commit()
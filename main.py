@@ -1,10 +1,13 @@
 
 # -*- coding: utf-8 -*-
-import os, io, math, logging, json
-from datetime import datetime
+import os, io, re, math, logging, json, threading, atexit, asyncio, time
+from datetime import datetime, timedelta
+from functools import lru_cache
 from typing import List, Dict
 
+import numpy as np
 import pandas as pd
+import db
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile, ReplyKeyboardMarkup, KeyboardButton
 from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes, MessageHandler, CallbackQueryHandler, filters
 
@@ -16,7 +19,8 @@ from reportlab.platypus import SimpleDocTemplate, Table, TableStyle
 logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
 log = logging.getLogger("koolbot")
 
-TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN", "8124361757:AAF1uVCDv_ocLokKQd5ySde8AmYcSLe6wZA")
+# TOKEN is what the deployed entrypoint historically read; keep it preferred.
+TELEGRAM_TOKEN = os.getenv("TOKEN") or os.getenv("TELEGRAM_TOKEN") or "8124361757:AAF1uVCDv_ocLokKQd5ySde8AmYcSLe6wZA"
 UNIT_PRICE = float(os.getenv("UNIT_PRICE", "700"))
 BASE_DIR = os.path.dirname(__file__)
 EXCEL_FILE = os.path.join(BASE_DIR, "KOOLEXIL.xlsx")
@@ -29,44 +33,68 @@ def ensure_admins_exists():
         data = {"users":[{"username":"مدير","pin":"1234","per_field":{}}]}
         with open(ADMINS_FILE, "w", encoding="utf-8") as f: json.dump(data, f, ensure_ascii=False, indent=2)
 
+# admins.json is consulted per button when rendering keyboards; cache the
+# parsed dict keyed on file mtime.
+_admins_cache = {"mtime": 0.0, "data": None, "by_name": None}
+
 def load_admins():
     ensure_admins_exists()
+    try: mtime=os.path.getmtime(ADMINS_FILE)
+    except OSError: mtime=0.0
+    if _admins_cache["data"] is not None and mtime==_admins_cache["mtime"]:
+        return _admins_cache["data"]
     with open(ADMINS_FILE, "r", encoding="utf-8") as f:
-        try: return json.load(f)
-        except: return {"users":[{"username":"مدير","pin":"1234","per_field":{}}]}
+        try: data=json.load(f)
+        except: data={"users":[{"username":"مدير","pin":"1234","per_field":{}}]}
+    _admins_cache["data"]=data; _admins_cache["mtime"]=mtime; _admins_cache["by_name"]=None
+    return data
 
 def save_admins(data):
     with open(ADMINS_FILE, "w", encoding="utf-8") as f: json.dump(data, f, ensure_ascii=False, indent=2)
+    _admins_cache["data"]=data; _admins_cache["by_name"]=None
+    try: _admins_cache["mtime"]=os.path.getmtime(ADMINS_FILE)
+    except OSError: _admins_cache["mtime"]=0.0
 
 def get_admin_names():
     return [u.get("username","") for u in load_admins().get("users",[]) if u.get("username")]
 
-def get_field_mode_for_user(username: str, field: str) -> str:
+def _admins_by_name(admins_data):
+    """{username -> user dict}; cached for the live admins data."""
+    if admins_data is _admins_cache["data"]:
+        if _admins_cache["by_name"] is None:
+            _admins_cache["by_name"]={u.get("username"): u for u in admins_data.get("users",[])}
+        return _admins_cache["by_name"]
+    return {u.get("username"): u for u in admins_data.get("users",[])}
+
+def get_field_mode_for_user(username: str, field: str, admins_data=None) -> str:
     """Return one of: read / edit / hide"""
-    for u in load_admins().get("users",[]):
-        if u.get("username")==username:
-            pf = u.get("per_field") or {}
-            mode = pf.get(field)
-            if mode: return mode
-            return "edit" if field in {"القراءة الحالية","المسدد","المتأخرات","رقم الهاتف","اسم المشترك"} else "read"
-    return "edit" if field in {"القراءة الحالية","المسدد","المتأخرات","رقم الهاتف","اسم المشترك"} else "read"
+    if admins_data is None: admins_data=load_admins()
+    default = "edit" if field in {"القراءة الحالية","المسدد","المتأخرات","رقم الهاتف","اسم المشترك"} else "read"
+    u=_admins_by_name(admins_data).get(username)
+    if u is None: return default
+    return (u.get("per_field") or {}).get(field) or default
 
 # ===== Columns =====
 BASE_COLS = ["اسم المشترك","رقم الهاتف","رقم العداد","القراءة السابقة","القراءة الحالية","الاستهلاك","قيمة الاستهلاك","المتأخرات","الإجمالي","المسدد","المتبقي"]
 DISPLAY_ORDER = ["اسم المشترك","رقم الهاتف","رقم العداد","القراءة السابقة","القراءة الحالية","مستهلك/وحده","مستهلك/ريال","المتأخرات","الإجمالي","المسدد","المتبقي"]
 EDITABLE_FIELDS = {"القراءة الحالية","المسدد","المتأخرات","رقم الهاتف","اسم المشترك"}
+NUMERIC_EDITABLE_FIELDS = frozenset(EDITABLE_FIELDS - {"اسم المشترك","رقم الهاتف"})
 
 # ===== Arabic normalization =====
-AR_DIAC="ًٌٍَُِّْ"; AR_DIAC_TABLE = str.maketrans("", "", AR_DIAC + "ـ"); AR_MAP=str.maketrans({"أ":"ا","إ":"ا","آ":"ا","ى":"ي","ة":"ه"})
-def ar_norm(s): 
+# One merged translation table: diacritics/tatweel/zero-width marks deleted,
+# hamza forms folded — a single C-level pass instead of chained translate/replace.
+AR_DIAC="ًٌٍَُِّْ"
+_AR_NORM_TABLE = {ord(c): None for c in AR_DIAC + "ـ‏‎"}
+_AR_NORM_TABLE.update({ord("أ"):"ا", ord("إ"):"ا", ord("آ"):"ا", ord("ٱ"):"ا", ord("ى"):"ي", ord("ة"):"ه"})
+# The helpers below see the same strings over and over (header aliases at
+# import, repeated user queries, re-normalized cells): memoize them.
+@lru_cache(maxsize=4096)
+def ar_norm(s):
     if s is None: return ""
-    s=str(s).strip().translate(AR_DIAC_TABLE).translate(AR_MAP).replace("\u200f","").replace("\u200e","")
-    return " ".join(s.split()).lower()
+    return " ".join(str(s).translate(_AR_NORM_TABLE).lower().split())
 
 ALIAS={"اسم المشترك":["اسم","المشترك","إسم المشترك","اسم  المشترك","اسم_المشترك"],"رقم الهاتف":["الهاتف","التلفون","رقم التلفون","رقم الجوال","الجوال","الموبايل","هاتف","تلفون"],"رقم العداد":["العداد","رقم  العداد","رقم-العداد"],"القراءة السابقة":["القراءه السابقه","قراءة سابقه","سابقه","السابقه"],"القراءة الحالية":["القراءه الحاليه","قراءة حاليه","الحاليه","حاليه"],"الاستهلاك":["مستهلك/وحده","مستهلك وحده","استهلاك","إستهلاك"],"قيمة الاستهلاك":["مستهلك/ريال","مستهلك ريال","قيمه الاستهلاك","قيمة-الاستهلاك"],"المتأخرات":["متاخرات","المتاخرات"],"الإجمالي":["الاجمالي","الاجمالي عليه","الإجمالي عليه","المجموع"],"المسدد":["المدفوع","مدفوع","المسدّد"],"المتبقي":["الباقي","الباقي عليه","المتبقي عليه"]}
-CANON={ar_norm(k):k for k in ALIAS}
-for k,arr in ALIAS.items():
-    for a in arr: CANON[ar_norm(a)]=k
+CANON={ar_norm(a): k for k, arr in ALIAS.items() for a in (k, *arr)}
 
 # ===== Excel helpers =====
 def ensure_excel_exists():
@@ -75,24 +103,92 @@ def ensure_excel_exists():
 
 def map_headers(df):
     df=df.rename(columns={c: CANON.get(ar_norm(c), c) for c in df.columns})
-    for c in BASE_COLS:
-        if c not in df.columns:
-            df[c] = "" if c in {"اسم المشترك","رقم الهاتف","رقم العداد"} else 0
+    missing=[c for c in BASE_COLS if c not in df.columns]
+    if missing:
+        df=df.reindex(columns=list(df.columns)+missing)
+        text_missing=[c for c in missing if c in {"اسم المشترك","رقم الهاتف","رقم العداد"}]
+        num_missing=[c for c in missing if c not in text_missing]
+        if text_missing: df[text_missing]=""
+        if num_missing: df[num_missing]=0
     return df
 
-def load_df():
-    ensure_excel_exists()
-    df = pd.read_excel(EXCEL_FILE); df = map_headers(df)
+def _migrate_excel_to_db():
+    """One-time import: seed subscribers.db from the legacy workbook."""
+    if os.path.exists(EXCEL_FILE):
+        try:
+            # Rust-backed parser, far faster than openpyxl for this read.
+            df = pd.read_excel(EXCEL_FILE, engine="calamine")
+        except ImportError:
+            # read_only streams the sheet instead of materializing the whole
+            # workbook DOM; data_only takes cached values for any formulas.
+            df = pd.read_excel(EXCEL_FILE, engine="openpyxl",
+                               engine_kwargs={"read_only": True, "data_only": True})
+        df = map_headers(df)
+    else:
+        df = pd.DataFrame(columns=BASE_COLS)
+    db.write_df(df)
+
+def _read_df_from_disk():
+    if not db.table_exists(): _migrate_excel_to_db()
+    df = db.read_df(); df = map_headers(df)
     for c in ["القراءة السابقة","القراءة الحالية","الاستهلاك","قيمة الاستهلاك","المتأخرات","الإجمالي","المسدد","المتبقي","مستهلك/وحده","مستهلك/ريال"]:
         if c in df.columns: df[c]=pd.to_numeric(df[c], errors="coerce").fillna(0)
     for c in ["اسم المشترك","رقم الهاتف","رقم العداد"]:
         if c in df.columns: df[c]=df[c].astype(str).fillna("").str.strip()
-    if "مستهلك/وحده" in df and "الاستهلاك" in df: df.loc[df["الاستهلاك"].eq(0), "الاستهلاك"]=df["مستهلك/وحده"]
-    if "مستهلك/ريال" in df and "قيمة الاستهلاك" in df: df.loc[df["قيمة الاستهلاك"].eq(0), "قيمة الاستهلاك"]=df["مستهلك/ريال"]
-    if {"المتبقي","الإجمالي","المسدد"}.issubset(df.columns): df["المتبقي"]=pd.to_numeric(df["الإجمالي"],errors="coerce").fillna(0)-pd.to_numeric(df["المسدد"],errors="coerce").fillna(0)
+    df = recompute_df(df)
     return df
 
-def save_df(df): df.to_excel(EXCEL_FILE, index=False)
+# ===== DataFrame cache =====
+# Parsing the workbook is by far the slowest thing the bot does, and every
+# handler used to do it. Keep one in-process copy, invalidated by file mtime,
+# and write back on a short debounce so bursts of edits cost one save.
+_df_cache = {"df": None, "mtime": 0.0, "dirty": False, "norm": None, "exact": None, "version": 0}
+_cache_lock = threading.RLock()
+# Serializes read-modify-write sequences in the async edit paths so two
+# concurrent edits cannot interleave between load and save.
+_df_lock = asyncio.Lock()
+_save_timer = None
+SAVE_DEBOUNCE_SEC = 0.5
+
+def load_df():
+    with _cache_lock:
+        if _df_cache["dirty"] and _df_cache["df"] is not None:
+            return _df_cache["df"]
+        try: mtime=os.path.getmtime(db.DB_FILE)
+        except OSError: mtime=0.0
+        if _df_cache["df"] is None or mtime!=_df_cache["mtime"]:
+            _df_cache["df"]=_read_df_from_disk(); _df_cache["norm"]=None; _df_cache["exact"]=None; _df_cache["tokens"]=None
+            _df_cache["version"]+=1
+            try: _df_cache["mtime"]=os.path.getmtime(db.DB_FILE)
+            except OSError: _df_cache["mtime"]=0.0
+        return _df_cache["df"]
+
+def _flush_df():
+    global _save_timer
+    with _cache_lock:
+        _save_timer=None
+        if not _df_cache["dirty"] or _df_cache["df"] is None: return
+        db.write_df(_df_cache["df"])
+        _df_cache["dirty"]=False
+        try: _df_cache["mtime"]=os.path.getmtime(db.DB_FILE)
+        except OSError: pass
+
+def save_df(df):
+    global _save_timer
+    with _cache_lock:
+        _df_cache["df"]=df; _df_cache["dirty"]=True; _df_cache["norm"]=None; _df_cache["exact"]=None; _df_cache["tokens"]=None
+        _df_cache["version"]+=1
+        if _save_timer is None:
+            _save_timer=threading.Timer(SAVE_DEBOUNCE_SEC, _flush_df)
+            _save_timer.daemon=True
+            _save_timer.start()
+
+atexit.register(_flush_df)
+
+async def load_df_async():
+    """Run load_df off the event loop: a cache miss parses from disk and must
+    not stall every other handler while it does."""
+    return await asyncio.to_thread(load_df)
 
 # ===== Formatting =====
 def strip_trailing_dot_zero(s): 
@@ -108,10 +204,30 @@ def fmt_int(v):
         if math.isnan(f) or math.isinf(f): return "0"
         return str(int(round(f)))
     except: return strip_trailing_dot_zero(v)
-def digits_only(s): return "".join(ch for ch in str(s) if ch.isdigit())
+_NONDIGIT = re.compile(r"\D+")
+@lru_cache(maxsize=4096)
+def digits_only(s): return _NONDIGIT.sub("", str(s))
+@lru_cache(maxsize=4096)
 def normalize_for_match(s): return ar_norm(s).replace(" ","")
 
 # ===== Computation =====
+def recompute_df(df):
+    """Vectorized recompute_row over the whole frame (used on load)."""
+    if not {"القراءة الحالية","القراءة السابقة","المتأخرات","المسدد"}.issubset(df.columns): return df
+    curr=pd.to_numeric(df["القراءة الحالية"], errors="coerce").fillna(0).to_numpy(dtype=float)
+    prev=pd.to_numeric(df["القراءة السابقة"], errors="coerce").fillna(0).to_numpy(dtype=float)
+    arrears=pd.to_numeric(df["المتأخرات"], errors="coerce").fillna(0).to_numpy(dtype=float)
+    paid=pd.to_numeric(df["المسدد"], errors="coerce").fillna(0).to_numpy(dtype=float)
+    cons=np.maximum(curr-prev, 0.0); cons_val=cons*UNIT_PRICE
+    total=arrears+cons_val; remain=total-paid
+    df["الاستهلاك"]=np.rint(cons).astype(np.int64)
+    df["قيمة الاستهلاك"]=np.rint(cons_val).astype(np.int64)
+    df["الإجمالي"]=np.rint(total).astype(np.int64)
+    df["المتبقي"]=np.rint(remain).astype(np.int64)
+    if "مستهلك/وحده" in df.columns: df["مستهلك/وحده"]=df["الاستهلاك"]
+    if "مستهلك/ريال" in df.columns: df["مستهلك/ريال"]=df["قيمة الاستهلاك"]
+    return df
+
 def recompute_row(row):
     current=float(row.get("القراءة الحالية",0) or 0); prev=float(row.get("القراءة السابقة",0) or 0)
     cons=max(current-prev,0); cons_val=cons*UNIT_PRICE
@@ -123,17 +239,122 @@ def recompute_row(row):
     if "مستهلك/ريال" in row.index: row["مستهلك/ريال"]=row["قيمة الاستهلاك"]
     return row
 
+# Derived columns downstream of each editable input. Name/phone edits have
+# no entry: nothing derived depends on them.
+DEPENDENCIES = {
+    "القراءة الحالية": ("الاستهلاك","قيمة الاستهلاك","الإجمالي","المتبقي","مستهلك/وحده","مستهلك/ريال"),
+    "القراءة السابقة": ("الاستهلاك","قيمة الاستهلاك","الإجمالي","المتبقي","مستهلك/وحده","مستهلك/ريال"),
+    "المتأخرات": ("الإجمالي","المتبقي"),
+    "المسدد": ("المتبقي",),
+}
+
+def update_derived(df, pos, col):
+    """Rewrite only the derived cells downstream of an edited column via iat."""
+    deps=DEPENDENCIES.get(col)
+    if not deps: return
+    cp=_col_pos(df)
+    def num(name):
+        if name not in cp: return 0.0
+        try: return float(df.iat[pos, cp[name]] or 0)
+        except (TypeError, ValueError): return 0.0
+    cons=max(num("القراءة الحالية")-num("القراءة السابقة"),0); cons_val=cons*UNIT_PRICE
+    total=num("المتأخرات")+cons_val; remain=total-num("المسدد")
+    vals={"الاستهلاك":int(round(cons)), "قيمة الاستهلاك":int(round(cons_val)),
+          "الإجمالي":int(round(total)), "المتبقي":int(round(remain))}
+    vals["مستهلك/وحده"]=vals["الاستهلاك"]; vals["مستهلك/ريال"]=vals["قيمة الاستهلاك"]
+    for dep in deps:
+        if dep in cp: df.iat[pos, cp[dep]]=vals[dep]
+
 # ===== Search =====
+SEARCH_FIELDS = ("اسم المشترك","رقم الهاتف","رقم العداد")
+
+def _build_norm_series(df, field):
+    # category dtype: repeated names/numbers share one string, and .str
+    # matching runs once per unique value instead of once per row. The live
+    # editable columns stay object dtype — categoricals reject .at writes of
+    # unseen values — so only these derived search Series are converted.
+    s=df[field].fillna("").astype(str)
+    return (s.map(normalize_for_match).astype("category"),
+            s.map(digits_only).astype("category"),
+            s.map(strip_trailing_dot_zero).astype("category"))
+
+def _norm_cols(df, field):
+    """Normalized/digits/stripped Series for a column, cached alongside the DataFrame."""
+    with _cache_lock:
+        if df is _df_cache["df"]:
+            if _df_cache["norm"] is None: _df_cache["norm"]={}
+            if field not in _df_cache["norm"]:
+                _df_cache["norm"][field]=_build_norm_series(df, field)
+            return _df_cache["norm"][field]
+    return _build_norm_series(df, field)
+
+def _exact_digits_index(df, field):
+    """{digit-string -> [row indices]} for a column, cached alongside the DataFrame."""
+    with _cache_lock:
+        if df is not _df_cache["df"]: return None
+        if _df_cache["exact"] is None: _df_cache["exact"]={}
+        if field not in _df_cache["exact"]:
+            idx={}
+            digits=_norm_cols(df, field)[1]
+            # zip over the raw arrays: .items() builds a Python scalar pair per row
+            for i,d in zip(digits.index.to_numpy(), digits.to_numpy()):
+                if d: idx.setdefault(d, []).append(i)
+            _df_cache["exact"][field]=idx
+        return _df_cache["exact"][field]
+
+def _name_token_index(df):
+    """{normalized name token -> [row indices]}, cached alongside the DataFrame."""
+    with _cache_lock:
+        if df is not _df_cache["df"] or "اسم المشترك" not in df.columns: return None
+        tok=_df_cache.get("tokens")
+        if tok is None:
+            tok={}
+            names=df["اسم المشترك"].fillna("").astype(str)
+            for i,name in zip(names.index.to_numpy(), names.to_numpy()):
+                for t in ar_norm(name).split():
+                    tok.setdefault(t, []).append(i)
+            _df_cache["tokens"]=tok
+        return tok
+
+def _col_pos(df):
+    """Column-name → position map so hot paths can use iat instead of label lookups."""
+    pos=_df_cache.get("cols")
+    if pos is None or len(pos)!=len(df.columns):
+        pos={c: i for i,c in enumerate(df.columns)}
+        _df_cache["cols"]=pos
+    return pos
+
+def _row_view(df, pos):
+    """Plain-dict view of one row; display and logging read a few keys and
+    don't need a full Series built."""
+    return {c: df.iat[pos, i] for c,i in _col_pos(df).items()}
+
 def find_row_indices(df, field, query):
     if field not in df.columns: return []
     q_raw=str(query).strip(); q_norm=normalize_for_match(q_raw); q_digits=digits_only(q_raw)
-    hits=[]
-    for i,v in df[field].fillna("").items():
-        v_str=str(v); v_norm=normalize_for_match(v_str); v_digits=digits_only(v_str)
-        if q_norm and q_norm in v_norm: hits.append(i)
-        elif q_digits and q_digits in v_digits: hits.append(i)
-        elif strip_trailing_dot_zero(v_str)==strip_trailing_dot_zero(q_raw): hits.append(i)
-    return list(dict.fromkeys(hits))
+    # Index probes rank exact matches first but never short-circuit: a query
+    # equal to one stored meter/phone must still surface superset matches
+    # from the substring scan (e.g. "777" alongside "777123456").
+    priority=[]
+    if q_digits and field in ("رقم العداد","رقم الهاتف"):
+        exact=_exact_digits_index(df, field)
+        if exact is not None: priority=exact.get(q_digits, [])
+    # Single-word name queries: whole-token matches rank first, but the scan
+    # still runs so the token can also match inside longer compound names.
+    if field=="اسم المشترك":
+        q_tok=ar_norm(q_raw).strip()
+        if q_tok and " " not in q_tok:
+            tokens=_name_token_index(df)
+            if tokens is not None: priority=tokens.get(q_tok, [])
+    norm, digits, stripped = _norm_cols(df, field)
+    mask = stripped.eq(strip_trailing_dot_zero(q_raw))
+    if q_norm: mask |= norm.str.contains(q_norm, regex=False, na=False)
+    if q_digits: mask |= digits.str.contains(q_digits, regex=False, na=False)
+    hits=list(df.index[mask])
+    if priority:
+        pset=set(priority)
+        hits=list(priority)+[i for i in hits if i not in pset]
+    return hits
 
 # ===== UI: Keyboard =====
 MAIN_KB = ReplyKeyboardMarkup([
@@ -151,14 +372,57 @@ MODE_ADD_SUB_NAME="add_sub_name"; MODE_ADD_SUB_PHONE="add_sub_phone"; MODE_ADD_S
 MODE_ADMIN_NEW_NAME="admin_new_name"; MODE_ADMIN_NEW_PIN="admin_new_pin"
 
 # ===== Activity Logging =====
+# Events go to logs.db (WAL mode) via parameterized INSERTs: no text
+# escaping of user-supplied names, safe across threads, far lower write
+# amplification than reopening a CSV per event. A legacy logs.csv is
+# imported once if present.
+_log_lock=threading.Lock()
+_log_migrated=False
+_log_buf=[]
+_log_timer=None
+_log_version=0  # bumped on every flush; report caches key on it
+LOG_FLUSH_SEC=3.0
+LOG_BUF_MAX=200  # overflow guard: flush inline rather than grow unbounded
+
+def _ensure_log_store():
+    global _log_migrated
+    if _log_migrated: return
+    conn=db.get_log_conn()
+    if os.path.exists(LOGS_FILE) and conn.execute(f"SELECT COUNT(*) FROM {db.EVENTS_TABLE}").fetchone()[0]==0:
+        try:
+            pd.read_csv(LOGS_FILE).to_sql(db.EVENTS_TABLE, conn, if_exists="append", index=False)
+        except Exception:
+            log.warning("تعذر استيراد logs.csv القديم إلى logs.db")
+    _log_migrated=True
+
+def _flush_log_buf():
+    """Write buffered events in one executemany transaction."""
+    global _log_timer, _log_version
+    with _log_lock:
+        _log_timer=None
+        if not _log_buf: return
+        rows=_log_buf[:]; _log_buf.clear()
+        _ensure_log_store()
+        db.log_insert_many(rows)
+        _log_version+=1
+
 def log_event(user_name, action, amount=0.0, meter="", subscriber=""):
+    # Buffer and flush on a short timer so bursts of edits amortize the
+    # disk write, same debounce pattern as save_df.
+    global _log_timer
     ts=datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
-    header="timestamp,user,action,amount,meter,subscriber\n"
-    line=f"{ts},{user_name},{action},{amount},{meter},{subscriber}\n"
-    newfile = not os.path.exists(LOGS_FILE) or os.path.getsize(LOGS_FILE)==0
-    with open(LOGS_FILE, "a", encoding="utf-8") as f:
-        if newfile: f.write(header)
-        f.write(line)
+    row=(ts, str(user_name), str(action), float(amount or 0), str(meter), str(subscriber))
+    flush_now=False
+    with _log_lock:
+        _log_buf.append(row)
+        flush_now=len(_log_buf)>=LOG_BUF_MAX
+        if not flush_now and _log_timer is None:
+            _log_timer=threading.Timer(LOG_FLUSH_SEC, _flush_log_buf)
+            _log_timer.daemon=True
+            _log_timer.start()
+    if flush_now: _flush_log_buf()
+
+atexit.register(_flush_log_buf)
 
 # ===== UI helpers =====
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -167,30 +431,42 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data.setdefault("active_admin", "مدير")
     await update.message.reply_text("مرحبًا بك في لوحة التحكم 👇", reply_markup=MAIN_KB)
 
-def format_vertical(row):
+def _fmt_text(v):
+    s=str(v)
+    return "" if s.lower() in {"nan","none"} else s
+
+def _build_display_spec():
     renames={"رقم الهاتف":"الهاتف","الإجمالي":"الإجمالي عليه","المتبقي":"المتبقي عليه","قيمة الاستهلاك":"المستهلك/ريال","الاستهلاك":"المستهلك/وحده"}
-    out=[]
+    numeric={"القراءة السابقة","القراءة الحالية","الاستهلاك","قيمة الاستهلاك","المتأخرات","الإجمالي","المسدد","المتبقي","مستهلك/وحده","مستهلك/ريال"}
+    fallbacks={"مستهلك/وحده":"الاستهلاك","مستهلك/ريال":"قيمة الاستهلاك"}
+    spec=[]
     for k in DISPLAY_ORDER:
-        if k in row.index: val=row.get(k,"")
-        elif k=="مستهلك/وحده": val=row.get("الاستهلاك","")
-        elif k=="مستهلك/ريال": val=row.get("قيمة الاستهلاك","")
+        fmt = fmt_int if k in numeric else (strip_trailing_dot_zero if k in {"رقم العداد","رقم الهاتف"} else _fmt_text)
+        spec.append((renames.get(k,k), k, fallbacks.get(k), fmt))
+    return tuple(spec)
+
+# (label, source column, fallback column, formatter) resolved once at import
+# instead of an if/elif chain per field per displayed record.
+_DISPLAY_SPEC = _build_display_spec()
+
+def format_vertical(row):
+    # row is any mapping (plain dict view or a Series; `in` hits the index).
+    out=[]
+    for label,key,fallback,fmt in _DISPLAY_SPEC:
+        if key in row: val=row.get(key,"")
+        elif fallback: val=row.get(fallback,"")
         else: val=""
-        if k in {"القراءة السابقة","القراءة الحالية","الاستهلاك","قيمة الاستهلاك","المتأخرات","الإجمالي","المسدد","المتبقي","مستهلك/وحده","مستهلك/ريال"}:
-            v=fmt_int(val)
-        elif k in {"رقم العداد","رقم الهاتف"}:
-            v=strip_trailing_dot_zero(val)
-        else:
-            v="" if str(val).lower() in {"nan","none"} else str(val)
-        title=renames.get(k,k); out.append(f"{title}\t{v}")
+        out.append(f"{label}\t{fmt(val)}")
     return "\n".join(out)
 
 def fields_inline_kb(cols: List[str], active_admin: str = None):
     rows=[]
+    admins_data = load_admins() if active_admin else None
     for col in cols:
         mode = "edit"
         try:
             if active_admin:
-                mode = get_field_mode_for_user(active_admin, col)
+                mode = get_field_mode_for_user(active_admin, col, admins_data)
         except Exception:
             mode = "edit"
         if mode == "hide":
@@ -228,7 +504,7 @@ async def text_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if text=="ايقونة الحقول":
         idx=context.user_data.get("selected_index")
         if idx is None: return await update.message.reply_text("⚠️ اختر مشتركًا أولًا بالبحث.", reply_markup=MAIN_KB)
-        df=load_df()
+        df=await load_df_async()
         if idx not in df.index: return await update.message.reply_text("⚠️ السجل غير موجود.", reply_markup=MAIN_KB)
         return await update.message.reply_text("قائمة الحقول:", reply_markup=fields_inline_kb(list(df.columns), active_admin=context.user_data.get("active_admin","مدير")))
 
@@ -321,11 +597,13 @@ async def handle_add_subscriber_flow(update: Update, context: ContextTypes.DEFAU
     if mode=="add_sub_paid":
         try: new["المسدد"]=float(text)
         except: return await update.message.reply_text("⚠️ أدخل رقمًا صحيحًا للمسدد.", reply_markup=MAIN_KB)
-        df=load_df()
-        for c in BASE_COLS:
-            if c not in new: new[c] = "" if c in {"اسم المشترك","رقم الهاتف","رقم العداد"} else 0
-        row=pd.Series(new); row=recompute_row(row)
-        df=pd.concat([df, pd.DataFrame([row])], ignore_index=True); save_df(df)
+        async with _df_lock:
+            df=await load_df_async()
+            for c in BASE_COLS:
+                if c not in new: new[c] = "" if c in {"اسم المشترك","رقم الهاتف","رقم العداد"} else 0
+            row=pd.Series(new); row=recompute_row(row)
+            # in-place append on the cached frame; pd.concat copied the whole block
+            df.loc[len(df)]=row; save_df(df)
         context.user_data["mode"]=MODE_NONE; context.user_data["selected_index"]=int(df.index[-1])
         return await update.message.reply_text("✅ تمت إضافة المشترك وحُسبت القيم.", reply_markup=MAIN_KB)
 
@@ -336,46 +614,21 @@ def fmt_display_title(row):
     phone=strip_trailing_dot_zero(row.get("رقم الهاتف",""))
     return f"{name} | عداد: {meter} | هاتف: {phone}"
 
-async def show_record(update: Update, context: ContextTypes.DEFAULT_TYPE, row: pd.Series):
-    df=load_df(); idx=context.user_data.get("selected_index")
-    if idx is not None and idx in df.index:
-        df.loc[idx]=recompute_row(df.loc[idx]); save_df(df); row=df.loc[idx]
+async def show_record(update: Update, context: ContextTypes.DEFAULT_TYPE, row):
+    idx=context.user_data.get("selected_index")
+    if idx is not None:
+        # the stale-derived refresh is a read-modify-write like the edit
+        # paths, so it takes the same lock; saving only when actually stale
+        async with _df_lock:
+            df=await load_df_async()
+            if idx in df.index:
+                new_row=recompute_row(df.loc[idx].copy())
+                if not new_row.equals(df.loc[idx]):
+                    df.loc[idx]=new_row; save_df(df)
+                row=new_row
     return await update.message.reply_text(format_vertical(row), reply_markup=MAIN_KB)
 
 # ===== Callback router =====
-    # ----- Add/Edit subscriber menu -----
-    if data.startswith("sub:"):
-        kind = data.split(":",1)[1]
-        if kind == "cancel":
-            await q.answer("تم الإلغاء");
-            return await q.message.reply_text("تم الإلغاء.", reply_markup=MAIN_KB)
-
-        if kind == "new":
-            await q.answer("مشترك جديد")
-            context.user_data["mode"]=MODE_ADD_SUB_NAME; context.user_data["new_sub"]={}
-            return await q.message.reply_text("أدخل اسم المشترك:", reply_markup=MAIN_KB)
-
-        if kind == "edit":
-            await q.answer("تعديل بيانات مشترك")
-            context.user_data["mode"]="sub_edit_choose"
-            kb = InlineKeyboardMarkup([
-                [InlineKeyboardButton("🔍 برقم العداد", callback_data="subedit:meter")],
-                [InlineKeyboardButton("🔎 بالاسم", callback_data="subedit:name")],
-                [InlineKeyboardButton("📞 بالهاتف", callback_data="subedit:phone")],
-                [InlineKeyboardButton("إلغاء", callback_data="sub:cancel")],
-            ])
-            return await q.message.reply_text("اختر طريقة البحث لتعديل بيانات مشترك:", reply_markup=kb)
-
-
-    if data.startswith("subedit:"):
-        kind = data.split(":",1)[1]
-        field_map={"meter":"رقم العداد","name":"اسم المشترك","phone":"رقم الهاتف"}
-        pick_field = field_map.get(kind, "رقم العداد")
-        context.user_data["mode"]="sub_edit_search"; context.user_data["subedit_field"]=pick_field
-        await q.answer()
-        return await q.message.reply_text(f"أدخل {pick_field}:", reply_markup=MAIN_KB)
-
-
 async def callback_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q=update.callback_query
     if not q: return
@@ -400,24 +653,26 @@ async def callback_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if data.startswith("pick::"):
         try: idx=int(data.split("::",1)[1])
         except: await q.answer(); return
-        context.user_data["selected_index"]=idx; df=load_df(); await q.answer("تم الاختيار")
+        context.user_data["selected_index"]=idx; df=await load_df_async(); await q.answer("تم الاختيار")
         # If we are in sub edit flow, show all fields to choose one to edit
         if context.user_data.get("mode")=="sub_edit_search":
             cols = list(df.columns)
             return await q.message.reply_text("اختر الحقل المراد تعديله:", reply_markup=fields_inline_kb(cols, active_admin=context.user_data.get("active_admin","مدير")))
+        pos=df.index.get_loc(idx) if idx in df.index else None; cp=_col_pos(df)
         if context.user_data.get("mode")==MODE_ADD_READING:
             context.user_data["edit_field"]="القراءة الحالية"; context.user_data["mode"]=MODE_AWAIT_VALUE
-            cur=df.at[idx,"القراءة الحالية"] if "القراءة الحالية" in df.columns else 0
-            prev=df.at[idx,"القراءة السابقة"] if "القراءة السابقة" in df.columns else 0
+            cur=df.iat[pos, cp["القراءة الحالية"]] if (pos is not None and "القراءة الحالية" in cp) else 0
+            prev=df.iat[pos, cp["القراءة السابقة"]] if (pos is not None and "القراءة السابقة" in cp) else 0
             return await q.message.reply_text(f"أدخل القيمة الجديدة للقراءة الحالية\n(الحالية الآن: {fmt_int(cur)} — السابقة: {fmt_int(prev)})", reply_markup=MAIN_KB)
         if context.user_data.get("mode")==MODE_SEARCH_PAY:
             context.user_data["edit_field"]="المسدد"; context.user_data["mode"]=MODE_AWAIT_VALUE
-            usage=fmt_int(df.at[idx,"قيمة الاستهلاك"] if "قيمة الاستهلاك" in df.columns else 0)
-            arrears=fmt_int(df.at[idx,"المتأخرات"] if "المتأخرات" in df.columns else 0)
-            total=fmt_int(df.at[idx,"الإجمالي"] if "الإجمالي" in df.columns else 0)
+            usage=fmt_int(df.iat[pos, cp["قيمة الاستهلاك"]] if (pos is not None and "قيمة الاستهلاك" in cp) else 0)
+            arrears=fmt_int(df.iat[pos, cp["المتأخرات"]] if (pos is not None and "المتأخرات" in cp) else 0)
+            total=fmt_int(df.iat[pos, cp["الإجمالي"]] if (pos is not None and "الإجمالي" in cp) else 0)
             msg=f"الاستهلاك (ريال): {usage}\nالمتأخرات: {arrears}\nالإجمالي: {total}\nأدخل المبلغ المسدد:"
             return await q.message.reply_text(msg, reply_markup=MAIN_KB)
-        return await q.message.reply_text(format_vertical(df.loc[idx]), reply_markup=MAIN_KB)
+        if pos is None: return await q.message.reply_text("السجل غير موجود.", reply_markup=MAIN_KB)
+        return await q.message.reply_text(format_vertical(_row_view(df, pos)), reply_markup=MAIN_KB)
 
     if data.startswith("field::"):
         col = data.split("::",1)[1]
@@ -435,13 +690,13 @@ async def callback_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
             idx = context.user_data.get("selected_index")
             if idx is None:
                 await q.answer(); return
-            df = load_df(); val = df.at[idx, col] if col in df.columns else ""
+            df = await load_df_async(); val = df.at[idx, col] if col in df.columns else ""
             return await q.message.reply_text(f"{col}: {fmt_int(val) if str(val).isdigit() else str(val)}", reply_markup=MAIN_KB)
         # Else ask for new value
         context.user_data["edit_field"] = col
         context.user_data["mode"] = MODE_AWAIT_VALUE
         idx = context.user_data.get("selected_index")
-        df = load_df()
+        df = await load_df_async()
         cur = df.at[idx, col] if (idx is not None and col in df.columns) else ""
         return await q.message.reply_text(f"أدخل القيمة الجديدة لـ {col}\n(القيمة الحالية: {fmt_int(cur) if str(cur).isdigit() else str(cur)})", reply_markup=MAIN_KB)
 
@@ -457,6 +712,37 @@ async def callback_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if data=="export:cancel":
         await q.answer("تم الإلغاء"); return await q.message.reply_text("تم إلغاء التصدير.", reply_markup=MAIN_KB)
 
+    # ----- Add/Edit subscriber menu -----
+    if data.startswith("sub:"):
+        kind = data.split(":",1)[1]
+        if kind == "cancel":
+            await q.answer("تم الإلغاء");
+            return await q.message.reply_text("تم الإلغاء.", reply_markup=MAIN_KB)
+
+        if kind == "new":
+            await q.answer("مشترك جديد")
+            context.user_data["mode"]=MODE_ADD_SUB_NAME; context.user_data["new_sub"]={}
+            return await q.message.reply_text("أدخل اسم المشترك:", reply_markup=MAIN_KB)
+
+        if kind == "edit":
+            await q.answer("تعديل بيانات مشترك")
+            context.user_data["mode"]="sub_edit_choose"
+            kb = InlineKeyboardMarkup([
+                [InlineKeyboardButton("🔍 برقم العداد", callback_data="subedit:meter")],
+                [InlineKeyboardButton("🔎 بالاسم", callback_data="subedit:name")],
+                [InlineKeyboardButton("📞 بالهاتف", callback_data="subedit:phone")],
+                [InlineKeyboardButton("إلغاء", callback_data="sub:cancel")],
+            ])
+            return await q.message.reply_text("اختر طريقة البحث لتعديل بيانات مشترك:", reply_markup=kb)
+
+    if data.startswith("subedit:"):
+        kind = data.split(":",1)[1]
+        field_map={"meter":"رقم العداد","name":"اسم المشترك","phone":"رقم الهاتف"}
+        pick_field = field_map.get(kind, "رقم العداد")
+        context.user_data["mode"]="sub_edit_search"; context.user_data["subedit_field"]=pick_field
+        await q.answer()
+        return await q.message.reply_text(f"أدخل {pick_field}:", reply_markup=MAIN_KB)
+
     # Admin menu
     if data.startswith("admin:"):
         kind=data.split(":",1)[1]
@@ -548,7 +834,7 @@ async def callback_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # ===== Search handler =====
 async def handle_search(update: Update, context: ContextTypes.DEFAULT_TYPE, mode: str, text: str):
-    df=load_df()
+    df=await load_df_async()
     if mode==MODE_ADD_READING: field=context.user_data.get("add_field") or "رقم العداد"
     elif mode==MODE_SEARCH_PAY: field=context.user_data.get("pay_field") or "رقم العداد"
     elif mode==MODE_SEARCH_METER: field="رقم العداد"
@@ -558,61 +844,68 @@ async def handle_search(update: Update, context: ContextTypes.DEFAULT_TYPE, mode
     idxs=find_row_indices(df, field, text)
     if not idxs: return await update.message.reply_text("❌ لا توجد نتائج مطابقة.", reply_markup=MAIN_KB)
     if len(idxs)>1:
-        buttons=[[InlineKeyboardButton(f"اختيار: {fmt_display_title(df.loc[i])}", callback_data=f"pick::{i}")] for i in idxs]
+        buttons=[[InlineKeyboardButton(f"اختيار: {fmt_display_title(_row_view(df, df.index.get_loc(i)))}", callback_data=f"pick::{i}")] for i in idxs]
         kb=InlineKeyboardMarkup(buttons+[[InlineKeyboardButton("إلغاء", callback_data="pick:cancel")]])
         return await update.message.reply_text("اختر السجل المطلوب:", reply_markup=kb)
     i=idxs[0]; context.user_data["selected_index"]=int(i)
+    pos=df.index.get_loc(i); cp=_col_pos(df)
     if mode==MODE_ADD_READING:
         context.user_data["edit_field"]="القراءة الحالية"; context.user_data["mode"]=MODE_AWAIT_VALUE
-        cur=df.at[i,"القراءة الحالية"] if "القراءة الحالية" in df.columns else 0
-        prev=df.at[i,"القراءة السابقة"] if "القراءة السابقة" in df.columns else 0
+        cur=df.iat[pos, cp["القراءة الحالية"]] if "القراءة الحالية" in cp else 0
+        prev=df.iat[pos, cp["القراءة السابقة"]] if "القراءة السابقة" in cp else 0
         return await update.message.reply_text(f"أدخل القيمة الجديدة للقراءة الحالية\n(الحالية الآن: {fmt_int(cur)} — السابقة: {fmt_int(prev)})", reply_markup=MAIN_KB)
     if mode==MODE_SEARCH_PAY:
         context.user_data["edit_field"]="المسدد"; context.user_data["mode"]=MODE_AWAIT_VALUE
-        usage=fmt_int(df.at[i,"قيمة الاستهلاك"] if "قيمة الاستهلاك" in df.columns else 0)
-        arrears=fmt_int(df.at[i,"المتأخرات"] if "المتأخرات" in df.columns else 0)
-        total=fmt_int(df.at[i,"الإجمالي"] if "الإجمالي" in df.columns else 0)
+        usage=fmt_int(df.iat[pos, cp["قيمة الاستهلاك"]] if "قيمة الاستهلاك" in cp else 0)
+        arrears=fmt_int(df.iat[pos, cp["المتأخرات"]] if "المتأخرات" in cp else 0)
+        total=fmt_int(df.iat[pos, cp["الإجمالي"]] if "الإجمالي" in cp else 0)
         return await update.message.reply_text(f"الاستهلاك (ريال): {usage}\nالمتأخرات: {arrears}\nالإجمالي: {total}\nأدخل المبلغ المسدد:", reply_markup=MAIN_KB)
-    return await show_record(update, context, df.loc[i])
+    return await show_record(update, context, _row_view(df, pos))
 
 # ===== Edit value (with special rules) =====
 async def handle_value_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
     idx=context.user_data.get("selected_index"); col=context.user_data.get("edit_field")
     if idx is None or not col:
         context.user_data["mode"]=MODE_NONE; return await update.message.reply_text("لا يوجد سياق تعديل نشط.", reply_markup=MAIN_KB)
-    df=load_df()
+    async with _df_lock:
+        return await _apply_value_input(update, context, idx, col)
+
+async def _apply_value_input(update: Update, context: ContextTypes.DEFAULT_TYPE, idx, col):
+    df=await load_df_async()
     if idx not in df.index:
         context.user_data["mode"]=MODE_NONE; return await update.message.reply_text("السجل غير موجود.", reply_markup=MAIN_KB)
     val=update.message.text.strip()
+    # Resolve the row/column positions once; every write below is a direct iat.
+    pos=df.index.get_loc(idx); cp=_col_pos(df)
     if col=="القراءة الحالية":
         try: new_curr=float(val)
         except: return await update.message.reply_text("⚠️ أدخل رقمًا صحيحًا.", reply_markup=MAIN_KB)
-        old_curr=float(df.at[idx,"القراءة الحالية"]) if "القراءة الحالية" in df.columns else 0
-        old_remain=float(df.at[idx,"المتبقي"]) if "المتبقي" in df.columns else 0
+        old_curr=float(df.iat[pos, cp["القراءة الحالية"]]) if "القراءة الحالية" in cp else 0
+        old_remain=float(df.iat[pos, cp["المتبقي"]]) if "المتبقي" in cp else 0
         # 1) السابقة = الحالية القديمة
-        if "القراءة السابقة" in df.columns: df.at[idx,"القراءة السابقة"]=old_curr
+        if "القراءة السابقة" in cp: df.iat[pos, cp["القراءة السابقة"]]=old_curr
         # 2) المتأخرات = المتبقي القديم (استبدال)
-        if "المتأخرات" in df.columns: df.at[idx,"المتأخرات"]=old_remain
+        if "المتأخرات" in cp: df.iat[pos, cp["المتأخرات"]]=old_remain
         # 3) المسدد = 0
-        if "المسدد" in df.columns: df.at[idx,"المسدد"]=0
+        if "المسدد" in cp: df.iat[pos, cp["المسدد"]]=0
         # تحديث الحالية
-        df.at[idx,"القراءة الحالية"]=new_curr
+        df.iat[pos, cp["القراءة الحالية"]]=new_curr
         # سجل العملية
         user=(update.effective_user.username or update.effective_user.full_name or "guest")
-        row=df.loc[idx]; log_event(user, "update_reading", amount=0, meter=str(row.get("رقم العداد","")), subscriber=str(row.get("اسم المشترك","")))
+        row=_row_view(df, pos); log_event(user, "update_reading", amount=0, meter=str(row.get("رقم العداد","")), subscriber=str(row.get("اسم المشترك","")))
     elif col=="المسدد":
         try: val_num=float(val)
         except: return await update.message.reply_text("⚠️ أدخل رقمًا صحيحًا.", reply_markup=MAIN_KB)
-        df.at[idx,"المسدد"]=val_num
+        df.iat[pos, cp["المسدد"]]=val_num
         user=(update.effective_user.username or update.effective_user.full_name or "guest")
-        row=df.loc[idx]; log_event(user, "pay", amount=val_num, meter=str(row.get("رقم العداد","")), subscriber=str(row.get("اسم المشترك","")))
-    elif col in EDITABLE_FIELDS - {"اسم المشترك","رقم الهاتف"}:
+        row=_row_view(df, pos); log_event(user, "pay", amount=val_num, meter=str(row.get("رقم العداد","")), subscriber=str(row.get("اسم المشترك","")))
+    elif col in NUMERIC_EDITABLE_FIELDS:
         try: val_num=float(val)
         except: return await update.message.reply_text("⚠️ أدخل رقمًا صحيحًا.", reply_markup=MAIN_KB)
-        df.at[idx, col]=val_num
+        df.iat[pos, cp[col]]=val_num
     else:
-        df.at[idx, col]=val
-    df.loc[idx]=recompute_row(df.loc[idx]); save_df(df)
+        df.iat[pos, cp[col]]=val
+    update_derived(df, pos, col); save_df(df)
     context.user_data["mode"]=MODE_NONE
     return await update.message.reply_text("✅ تم التحديث.", reply_markup=MAIN_KB)
 
@@ -621,84 +914,168 @@ def df_clean_for_export(df: pd.DataFrame) -> pd.DataFrame:
     cols = [c for c in BASE_COLS if c in df.columns] + [c for c in df.columns if c not in BASE_COLS]
     df = df[cols].copy()
     for c in df.columns:
-        num = pd.to_numeric(df[c], errors="coerce")
-        if num.notna().any():
-            nums = num.fillna(0).astype(float).round(0).astype(int).astype(str)
-            nums[num.isna()] = ""
-            df[c] = nums
+        num = pd.to_numeric(df[c], errors="coerce").to_numpy(dtype=float)
+        mask = ~np.isnan(num)
+        if mask.any():
+            out = np.empty(len(num), dtype=object)
+            out[mask] = np.rint(num[mask]).astype(np.int64).astype(str)
+            out[~mask] = ""
+            df[c] = out
         else:
             df[c] = df[c].astype(str).replace({"nan":"", "None":""}).fillna("")
     return df
 
+_clean_cache = {"version": -1, "df": None}
+
+def _get_clean_df():
+    """Cleaned export frame shared by the Excel and PDF paths, rebuilt only
+    when the data version changes."""
+    df=load_df()
+    with _cache_lock:
+        ver=_df_cache["version"]
+        if _clean_cache["version"]==ver and _clean_cache["df"] is not None:
+            return _clean_cache["df"]
+    cdf=df_clean_for_export(df)
+    with _cache_lock:
+        _clean_cache["version"]=ver; _clean_cache["df"]=cdf
+    return cdf
+
+def _to_excel_fast(df, target):
+    """Write xlsx with the faster xlsxwriter engine; the fallback streams rows
+    through openpyxl write_only mode instead of building the cell DOM."""
+    try:
+        df.to_excel(target, index=False, engine="xlsxwriter")
+    except ImportError:
+        import openpyxl
+        wb=openpyxl.Workbook(write_only=True); ws=wb.create_sheet()
+        ws.append(list(df.columns))
+        for row in df.itertuples(index=False, name=None): ws.append(row)
+        wb.save(target)
+
+@lru_cache(maxsize=8)
 def calc_col_widths_for_page(num_cols: int, page_width: float, left_margin: float=12, right_margin: float=12):
     usable = page_width - left_margin - right_margin
-    if num_cols <= 0: return []
+    if num_cols <= 0: return ()
     w = usable / num_cols
-    return [w] * num_cols
+    return (w,) * num_cols
+
+PDF_CHUNK_ROWS = 40  # bounds reportlab's quadratic page-break search per table
 
-def df_to_pdf_landscape(df, out_path, title="تصدير البيانات"):
+def df_to_pdf_landscape(cdf, out_path, title="تصدير البيانات"):
+    """Render an already-cleaned frame (df_clean_for_export output) to PDF;
+    callers clean once so the shared cached frame isn't re-cleaned here."""
     from reportlab.platypus import SimpleDocTemplate, Table, TableStyle
     from reportlab.lib.pagesizes import A4, landscape
-    cdf = df_clean_for_export(df)
-    data = [list(cdf.columns)] + cdf.astype(str).values.tolist()
+    header = list(cdf.columns)
+    rows = cdf.astype(str).values.tolist()
     pagesize = landscape(A4)
     left=12; right=12; top=14; bottom=14
     doc = SimpleDocTemplate(out_path, pagesize=pagesize, rightMargin=right, leftMargin=left, topMargin=top, bottomMargin=bottom)
     col_widths = calc_col_widths_for_page(len(cdf.columns), pagesize[0], left, right)
-    table = Table(data, colWidths=col_widths, repeatRows=1)
     style = TableStyle([('BACKGROUND',(0,0),(-1,0),colors.lightgrey),('GRID',(0,0),(-1,-1),0.25,colors.grey),('FONTNAME',(0,0),(-1,0),'Helvetica-Bold'),('FONTSIZE',(0,0),(-1,-1),8),('ALIGN',(0,0),(-1,0),'CENTER'),('VALIGN',(0,0),(-1,-1),'MIDDLE')])
-    # right-align numeric-ish columns
+    # right-align numeric-ish columns (C-level coercion, no per-cell regex)
+    numeric_cols = {c for c in cdf.columns if pd.to_numeric(cdf[c], errors="coerce").notna().mean() > 0.6}
     for ci,col in enumerate(cdf.columns):
-        try:
-            col_vals = cdf[col].astype(str).str.replace(r'[^0-9]', '', regex=True)
-            ratio = (col_vals.str.len() > 0).sum() / max(1, len(col_vals))
-            if ratio > 0.6:
-                style.add('ALIGN', (ci,1), (ci,-1), 'RIGHT')
-        except: pass
-    table.setStyle(style)
-    doc.build([table])
+        if col in numeric_cols:
+            style.add('ALIGN', (ci,1), (ci,-1), 'RIGHT')
+    # one fixed-size Table per block instead of a single giant one
+    cmds = style.getCommands()
+    story = []
+    for start in range(0, len(rows), PDF_CHUNK_ROWS):
+        block = Table([header] + rows[start:start+PDF_CHUNK_ROWS], colWidths=col_widths, repeatRows=1)
+        block.setStyle(TableStyle(cmds))
+        story.append(block)
+    if not story:
+        empty = Table([header], colWidths=col_widths, repeatRows=1)
+        empty.setStyle(TableStyle(cmds))
+        story.append(empty)
+    doc.build(story)
 
 async def send_excel(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    df=load_df(); df=df_clean_for_export(df); bio=io.BytesIO(); df.to_excel(bio, index=False); bio.seek(0)
-    await update.effective_chat.send_document(document=InputFile(bio, filename="KOOLEXIL.xlsx"), caption="📦 ملف Excel الحالي")
+    df=await asyncio.to_thread(_get_clean_df); tmp=os.path.join(BASE_DIR,"export.xlsx")
+    await asyncio.to_thread(_to_excel_fast, df, tmp)
+    with open(tmp,"rb") as f:
+        await update.effective_chat.send_document(document=InputFile(f, filename="KOOLEXIL.xlsx"), caption="📦 ملف Excel الحالي")
+    try: os.remove(tmp)
+    except: pass
     await update.effective_chat.send_message("العودة للوحة التحكم:", reply_markup=MAIN_KB)
 
 async def send_pdf(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    df=load_df(); df=df_clean_for_export(df); tmp=os.path.join(BASE_DIR,"export.pdf"); df_to_pdf_landscape(df, tmp, title="تصدير البيانات")
-    with open(tmp,"rb") as f: pdf_bytes=f.read()
-    bio=io.BytesIO(pdf_bytes); bio.seek(0)
-    await update.effective_chat.send_document(document=InputFile(bio, filename="KOOLEXIL.pdf"), caption="📄 PDF (أفقي)")
+    df=await asyncio.to_thread(_get_clean_df); tmp=os.path.join(BASE_DIR,"export.pdf")
+    await asyncio.to_thread(df_to_pdf_landscape, df, tmp, "تصدير البيانات")
+    with open(tmp,"rb") as f:
+        await update.effective_chat.send_document(document=InputFile(f, filename="KOOLEXIL.pdf"), caption="📄 PDF (أفقي)")
     try: os.remove(tmp)
     except: pass
     await update.effective_chat.send_message("العودة للوحة التحكم:", reply_markup=MAIN_KB)
 
 # ===== Reports =====
-async def generate_and_send_report(update: Update, context: ContextTypes.DEFAULT_TYPE, fmt="excel"):
-    if not os.path.exists(LOGS_FILE) or os.path.getsize(LOGS_FILE)==0:
-        return await update.effective_chat.send_message("لا يوجد سجل عمليات بعد.", reply_markup=MAIN_KB)
-    df=pd.read_csv(LOGS_FILE)
-    try: df["date"]=pd.to_datetime(df["timestamp"]).dt.date
-    except: pass
-    filt=context.user_data.get("report_filter", {"type":"all"})
+_summary_cache={"key": None, "ts": 0.0, "log_ver": -1, "df": None}
+SUMMARY_TTL_SEC=60.0
+
+def _summary_key(filt):
+    t=filt.get("type","all")
+    if t=="day": return ("day", str(filt.get("day")))
+    if t=="range": return ("range", str(filt.get("start")), str(filt.get("end")))
+    return ("all",)
+
+def _compute_summary(filt):
+    """Per-user aggregation for a report filter. Cached briefly so asking for
+    the second format reuses the first query; new flushed events invalidate.
+    Raises on unparseable dates."""
+    key=_summary_key(filt)
+    with _log_lock:
+        c=_summary_cache
+        if (c["df"] is not None and c["key"]==key and c["log_ver"]==_log_version
+                and time.time()-c["ts"]<SUMMARY_TTL_SEC):
+            return c["df"]
+        ver=_log_version
+    where=""; params=[]
     if filt.get("type")=="day":
-        try: target=pd.to_datetime(filt.get("day")).date(); df=df[df["date"]==target]
-        except: return await update.effective_chat.send_message("صيغة التاريخ غير صحيحة لليوم المحدد.", reply_markup=MAIN_KB)
+        target=pd.to_datetime(filt.get("day")).date()
+        # Timestamps are ISO strings, so plain string ranges filter without
+        # evaluating date() per row.
+        where=" WHERE timestamp>=? AND timestamp<?"; params=[str(target), str(target+timedelta(days=1))]
     elif filt.get("type")=="range":
-        try: start=pd.to_datetime(filt.get("start")).date(); end=pd.to_datetime(filt.get("end")).date(); df=df[(df["date"]>=start)&(df["date"]<=end)]
-        except: return await update.effective_chat.send_message("صيغة التاريخ غير صحيحة لنطاق التواريخ.", reply_markup=MAIN_KB)
-    df["amount"]=pd.to_numeric(df.get("amount",0), errors="coerce").fillna(0)
-    summary=df.groupby("user").agg(عدد_العمليات=("action","count"), اجمالي_المسددة=("amount","sum")).reset_index().rename(columns={"user":"المسؤول"})
-    if summary.empty: return await update.effective_chat.send_message("لا توجد بيانات ضمن المدة المحددة.", reply_markup=MAIN_KB)
+        start=pd.to_datetime(filt.get("start")).date(); end=pd.to_datetime(filt.get("end")).date()
+        where=" WHERE timestamp>=? AND timestamp<?"; params=[str(start), str(end+timedelta(days=1))]
+    # Filter + groupby pushed down to SQLite: only the per-user summary is materialized.
+    q=(f'SELECT user AS "المسؤول", COUNT(*) AS "عدد_العمليات", '
+       f'COALESCE(SUM(amount),0) AS "اجمالي_المسددة" FROM {db.EVENTS_TABLE}{where} GROUP BY user')
+    summary=pd.read_sql_query(q, db.get_log_conn(), params=params)
+    with _log_lock:
+        _summary_cache.update(key=key, ts=time.time(), log_ver=ver, df=summary)
+    return summary
+
+async def _render_summary(update, summary, fmt):
+    """Serialize an already-computed summary as PDF or Excel and send it."""
     if fmt=="pdf":
-        tmp=os.path.join(BASE_DIR,"report.pdf"); df_to_pdf_landscape(summary, tmp, title="تقرير مجدول")
-        with open(tmp,"rb") as f: pdf_bytes=f.read()
-        bio=io.BytesIO(pdf_bytes); bio.seek(0)
-        await update.effective_chat.send_document(InputFile(bio, filename="scheduled_report.pdf"), caption="تقرير مجدول (PDF)")
-        try: os.remove(tmp)
-        except: pass
+        tmp=os.path.join(BASE_DIR,"report.pdf")
+        await asyncio.to_thread(lambda: df_to_pdf_landscape(df_clean_for_export(summary), tmp, "تقرير مجدول"))
+        with open(tmp,"rb") as f:
+            await update.effective_chat.send_document(InputFile(f, filename="scheduled_report.pdf"), caption="تقرير مجدول (PDF)")
     else:
-        bio=io.BytesIO(); summary.to_excel(bio, index=False); bio.seek(0)
-        await update.effective_chat.send_document(InputFile(bio, filename="scheduled_report.xlsx"), caption="تقرير مجدول (Excel)")
+        tmp=os.path.join(BASE_DIR,"report.xlsx")
+        await asyncio.to_thread(_to_excel_fast, summary, tmp)
+        with open(tmp,"rb") as f:
+            await update.effective_chat.send_document(InputFile(f, filename="scheduled_report.xlsx"), caption="تقرير مجدول (Excel)")
+    try: os.remove(tmp)
+    except: pass
+
+async def generate_and_send_report(update: Update, context: ContextTypes.DEFAULT_TYPE, fmt="excel"):
+    await asyncio.to_thread(_flush_log_buf)  # pending buffered events must land before the read
+    with _log_lock: _ensure_log_store()
+    conn=db.get_log_conn()
+    if not conn.execute(f"SELECT EXISTS(SELECT 1 FROM {db.EVENTS_TABLE})").fetchone()[0]:
+        return await update.effective_chat.send_message("لا يوجد سجل عمليات بعد.", reply_markup=MAIN_KB)
+    filt=context.user_data.get("report_filter", {"type":"all"})
+    try:
+        summary=await asyncio.to_thread(_compute_summary, filt)
+    except Exception:
+        msg="صيغة التاريخ غير صحيحة لليوم المحدد." if filt.get("type")=="day" else "صيغة التاريخ غير صحيحة لنطاق التواريخ."
+        return await update.effective_chat.send_message(msg, reply_markup=MAIN_KB)
+    if summary.empty: return await update.effective_chat.send_message("لا توجد بيانات ضمن المدة المحددة.", reply_markup=MAIN_KB)
+    await _render_summary(update, summary, fmt)
     await update.effective_chat.send_message("العودة للوحة التحكم:", reply_markup=MAIN_KB)
 
 async def text_date_router(update: Update, context: ContextTypes.DEFAULT_TYPE):